@@ -0,0 +1,4 @@
+# Загружаем приложение Celery при старте Django, чтобы @shared_task его подхватили
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
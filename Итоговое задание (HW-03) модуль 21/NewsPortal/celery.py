@@ -0,0 +1,11 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'NewsPortal.settings')
+
+app = Celery('NewsPortal')
+
+# Все настройки Celery берутся из settings.py с префиксом CELERY_
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
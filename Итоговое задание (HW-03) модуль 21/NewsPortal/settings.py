@@ -87,6 +87,29 @@ ACCOUNT_FORMS = {
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 SITE_URL = 'http://127.0.0.1:8000'
 
+# 🆕 НАСТРОЙКИ CELERY (фоновая отправка писем)
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/0')
+# Задачи рассылки ничего не возвращают, поэтому результаты не сохраняются
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_TIMEZONE = 'Europe/Moscow'
+# Письма уходят в отдельную очередь, чтобы воркеры почты масштабировались независимо
+CELERY_TASK_ROUTES = {
+    'news.tasks.send_*': {'queue': 'email_queue'},
+}
+
+# 🆕 НАСТРОЙКИ КЭША
+# Общий Redis нужен, чтобы блокировки через cache.add (см. news.signals) работали между процессами;
+# без REDIS_CACHE_URL используется локальный кэш процесса (подходит только для разработки)
+if os.environ.get('REDIS_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_CACHE_URL'],
+        }
+    }
+
 
 DATABASES = {
     'default': {
@@ -58,6 +58,12 @@ class Category(models.Model):
     def get_subscribers_count(self):
         return self.subscribers.count()
 
+    def get_subscribers(self):
+        """Подписчики категории (использует предзагруженный список prefetched_subs, если он есть)"""
+        if hasattr(self, 'prefetched_subs'):
+            return self.prefetched_subs
+        return self.subscribers.all()
+
     def get_weekly_posts(self):
         """Возвращает посты за последнюю неделю"""
         week_ago = timezone.now() - timedelta(days=7)
@@ -146,7 +152,7 @@ class Post(models.Model):
 
         categories = self.categories.all()
         for category in categories:
-            subscribers = category.subscribers.all()
+            subscribers = category.get_subscribers()
             for subscriber in subscribers:
                 self._send_single_notification(subscriber, category)
 
@@ -135,7 +135,7 @@ class EmailService:
         categories = post.categories.all()
 
         for category in categories:
-            subscribers = category.subscribers.all()
+            subscribers = category.get_subscribers()
 
             for subscriber in subscribers:
                 if subscriber.email:
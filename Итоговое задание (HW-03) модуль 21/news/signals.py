@@ -1,20 +1,91 @@
 from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User, Group
-from django.db import transaction
+from django.db import IntegrityError, connection, transaction
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
 from allauth.account.signals import user_signed_up
 from allauth.socialaccount.signals import social_account_added
-
-from .models import Post, Author, ActivationToken, Category, Subscription
-from .services.email_service import EmailService
+from kombu.exceptions import OperationalError as BrokerError
+from contextlib import contextmanager
+
+from .models import Post, Author, ActivationToken, Category, Subscription, Comment
+from .tasks import (
+    send_welcome_email_task,
+    send_activation_success_email_task,
+    send_article_notification_task,
+)
 import logging
 
 # Настройка логгера
 logger = logging.getLogger('news.signals')
 
+# Ключи кэша, которые сбрасываются при создании любого поста
+_STATIC_POST_CACHE_KEYS = ('latest_news', 'news_list', 'categories_list')
+
+# PK групп пользователей по имени (заполняется в _group_id, сбрасывается в reset_group_ids_cache)
+_GROUP_IDS = {}
+
+
+def _group_id(name):
+    """
+    Возвращает PK группы, создавая ее при необходимости.
+    PK попадает в кэш только после коммита, чтобы откат транзакции не оставил в нем удаленную группу
+    """
+    group_id = _GROUP_IDS.get(name)
+    if group_id is None:
+        group_id = Group.objects.get_or_create(name=name)[0].pk
+        transaction.on_commit(lambda: _GROUP_IDS.update({name: group_id}))
+    return group_id
+
+
+def _add_user_to_group(user_id, group_name):
+    """
+    Добавляет пользователя в группу одним INSERT без предварительной проверки членства
+    (уже существующая связь пропускается благодаря ignore_conflicts)
+    """
+    UserGroups = User.groups.through
+
+    def insert():
+        # Внешние ключи в Django отложенные (DEFERRABLE INITIALLY DEFERRED): внутри внешней
+        # транзакции нарушение всплыло бы только на ее COMMIT и откатило бы ее целиком.
+        # Поэтому проверяем ограничения явно, пока savepoint еще можно откатить
+        in_outer_transaction = connection.in_atomic_block
+        with transaction.atomic():
+            UserGroups.objects.bulk_create(
+                [UserGroups(user_id=user_id, group_id=_group_id(group_name))],
+                ignore_conflicts=True,
+            )
+            if in_outer_transaction:
+                connection.check_constraints(table_names=[UserGroups._meta.db_table])
+
+    try:
+        insert()
+    except IntegrityError:
+        # ignore_conflicts не покрывает внешние ключи: группу удалили в другом процессе,
+        # сбрасываем кэш и повторяем вставку один раз со свежим PK
+        _GROUP_IDS.clear()
+        insert()
+
+
+def _delete_cache_on_commit(keys):
+    """
+    Удаляет ключи кэша после коммита транзакции, чтобы конкурентный запрос
+    не успел заново закэшировать данные до коммита
+    """
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+# 🔄 СИГНАЛЫ ДЛЯ ГРУПП
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def reset_group_ids_cache(sender, **kwargs):
+    """
+    Сбрасывает кэш PK групп при изменении или удалении группы (например, через админку)
+    """
+    _GROUP_IDS.clear()
+
 
 # 🔄 СИГНАЛЫ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ
 @receiver(user_signed_up)
@@ -25,25 +96,26 @@ def handle_user_signed_up(sender, request, user, **kwargs):
     logger.info(f"🆕 Регистрация пользователя через allauth: {user.email}")
 
     try:
-        # Добавляем в группу common
-        common_group, created = Group.objects.get_or_create(name='common')
-        user.groups.add(common_group)
+        # Все записи регистрации выполняются одной транзакцией
+        with transaction.atomic():
+            # Добавляем в группу common
+            _add_user_to_group(user.pk, 'common')
 
-        # Создаем профиль автора
-        author, author_created = Author.objects.get_or_create(user=user)
+            # Создаем профиль автора
+            author, author_created = Author.objects.get_or_create(user=user)
 
-        # Создаем токен активации
-        activation_token = ActivationToken.create_token(user)
+            # Создаем токен активации
+            activation_token = ActivationToken.create_token(user)
 
-        # Формируем URL для активации
-        activation_url = f"{settings.SITE_URL}/accounts/activate/{activation_token.token}/"
+            # Формируем URL для активации
+            activation_url = f"{settings.SITE_URL}/accounts/activate/{activation_token.token}/"
 
-        # Отправляем приветственное письмо
-        EmailService.send_welcome_email(user, activation_url)
+            # Письмо ставится в очередь только после успешного коммита
+            transaction.on_commit(lambda: send_welcome_email_task.delay(user.id, activation_url))
 
         logger.info(f"✅ Пользователь {user.email} зарегистрирован. Author создан: {author_created}")
 
-    except Exception as e:
+    except (IntegrityError, BrokerError, ConnectionError) as e:
         logger.error(f"❌ Ошибка при обработке регистрации пользователя {user.email}: {e}")
 
 
@@ -58,47 +130,39 @@ def handle_social_signup(sender, request, sociallogin, **kwargs):
     # Для социальных регистраций сразу активируем аккаунт
     activation_token, created = ActivationToken.objects.get_or_create(user=user)
     activation_token.activated = True
-    activation_token.save()
+    # Обновляем только флаг активации; post_save нужен для письма и группы authors
+    activation_token.save(update_fields=['activated'])
 
 
 @receiver(post_save, sender=User)
 def handle_user_post_save(sender, instance, created, **kwargs):
     """
-    Резервный обработчик для пользователей (на случай если allauth не сработает)
+    Создает профиль автора при создании пользователя и добавляет его в группу common
+    (резервный обработчик на случай если allauth не сработает)
     """
-    if created and not instance.is_staff:
-        logger.info(f"🆕 Резервная обработка пользователя: {instance.username}")
-
-        # Проверяем, не обработан ли уже пользователь
-        if not instance.groups.filter(name='common').exists():
-            common_group, created = Group.objects.get_or_create(name='common')
-            instance.groups.add(common_group)
+    if not created:
+        return
 
-            # Создаем профиль автора
-            Author.objects.get_or_create(user=instance)
+    # Создаем профиль автора (без обращения к обратной связи instance.author)
+    author, author_created = Author.objects.get_or_create(user_id=instance.pk)
+    if author_created:
+        logger.info(f"👤 Создан профиль автора для: {instance.username}")
 
+    if not instance.is_staff:
+        logger.info(f"🆕 Резервная обработка пользователя: {instance.username}")
 
-# 🔄 СИГНАЛЫ ДЛЯ АВТОРОВ
-@receiver(post_save, sender=User)
-def create_author_profile(sender, instance, created, **kwargs):
-    """
-    Создает профиль автора при создании пользователя
-    """
-    if created and not hasattr(instance, 'author'):
-        Author.objects.create(user=instance)
-        logger.info(f"👤 Создан профиль автора для: {instance.username}")
+        _add_user_to_group(instance.pk, 'common')
 
 
+# 🔄 СИГНАЛЫ ДЛЯ АВТОРОВ
 @receiver(post_delete, sender=Author)
 def cleanup_user_group(sender, instance, **kwargs):
     """
     Очистка групп при удалении автора
     """
-    try:
-        instance.user.groups.filter(name='authors').delete()
-        logger.info(f"🧹 Удалены группы автора для: {instance.user.username}")
-    except Exception as e:
-        logger.error(f"❌ Ошибка при очистке групп: {e}")
+    # Ошибки не перехватываем: удаление выполняется в транзакции удаления автора и откатится вместе с ней
+    instance.user.groups.filter(name='authors').delete()
+    logger.info(f"🧹 Удалены группы автора для: {instance.user.username}")
 
 
 # 🔄 СИГНАЛЫ ДЛЯ ПОСТОВ И УВЕДОМЛЕНИЙ
@@ -124,48 +188,44 @@ def handle_post_save(sender, instance, created, **kwargs):
     if created:
         logger.info(f"📝 Создан новый пост: '{instance.title}' (тип: {instance.get_post_type_display()})")
 
-        # Для новых постов с уже установленными категориями
-        if created and instance.categories.exists():
-            logger.info(f"📧 Запланирована отправка уведомлений для нового поста")
-            transaction.on_commit(lambda: process_post_notifications(instance))
+        # 🆕 Новые статьи попадают в еженедельный дайджест
+        if instance.post_type == Post.ARTICLE:
+            logger.info(f"📄 Новая статья создана: '{instance.title}' - будет включена в еженедельный дайджест")
+
+        # Уведомления подписчикам планирует handle_post_categories_changed:
+        # у только что созданного поста связей с категориями еще нет
 
         # Инвалидация кэша
-        cache_keys = [
-            'latest_news',
-            'news_list',
-            f'post_{instance.id}',
-            'categories_list'
-        ]
-        for key in cache_keys:
-            cache.delete(key)
+        _delete_cache_on_commit((*_STATIC_POST_CACHE_KEYS, f'post_{instance.pk}'))
 
-        logger.debug("🧹 Кэш очищен после создания поста")
+        logger.debug("🧹 Очистка кэша запланирована после создания поста")
 
 
 def process_post_notifications(post):
     """
-    Обрабатывает отправку уведомлений после коммита транзакции
+    Ставит отправку уведомлений в очередь после коммита транзакции
     """
-    logger.info(f"📧 Начало обработки уведомлений для поста: '{post.title}' (ID: {post.pk})")
+    # Флаг уже загружен вместе с постом: если уведомления отправлены, не нагружаем очередь и БД воркера
+    if post.notifications_sent:
+        logger.debug(f"⏭️ Уведомления для поста {post.pk} уже отправлены")
+        return
+
+    # cache.add атомарен в пределах бэкенда кэша: повторный вызов для того же поста
+    # (например, при нескольких post_add) ничего не делает. Между процессами это работает
+    # только с общим кэшем (Redis, REDIS_CACHE_URL); LocMemCache защищает лишь внутри процесса
+    lock_key = f"notif_sent_{post.pk}"
+    if not cache.add(lock_key, 1, timeout=3600):
+        logger.debug(f"⏭️ Уведомления для поста {post.pk} уже поставлены в очередь")
+        return
+
+    logger.info(f"📧 Постановка уведомлений в очередь для поста: '{post.title}' (ID: {post.pk})")
 
     try:
-        # Перезагружаем пост для получения актуальных данных
-        refreshed_post = Post.objects.select_related('author__user').prefetch_related('categories').get(pk=post.pk)
-
-        # Отправляем уведомления в зависимости от типа поста
-        if refreshed_post.post_type == Post.NEWS:
-            # Для новостей используем стандартный метод
-            refreshed_post.send_notifications_to_subscribers()
-            logger.info("✅ Уведомления о новости успешно отправлены!")
-        elif refreshed_post.post_type == Post.ARTICLE:
-            # Для статей используем специальный метод из EmailService
-            EmailService.send_immediate_article_notification(refreshed_post)
-            logger.info("✅ Уведомления о статье успешно отправлены!")
-
-    except Post.DoesNotExist:
-        logger.error(f"❌ Пост с ID {post.pk} не найден в базе данных")
-    except Exception as e:
-        logger.error(f"❌ Критическая ошибка при отправке уведомлений: {e}")
+        send_article_notification_task.delay(post.pk)
+    except (BrokerError, ConnectionError) as e:
+        # Снимаем блокировку, чтобы следующая попытка могла поставить задачу
+        cache.delete(lock_key)
+        logger.error(f"❌ Критическая ошибка при постановке уведомлений в очередь: {e}")
 
 
 # 🔄 СИГНАЛЫ ДЛЯ АКТИВАЦИИ
@@ -177,18 +237,24 @@ def handle_activation_token_save(sender, instance, created, **kwargs):
     if instance.activated and not created:  # Только при активации существующего токена
         logger.info(f"✅ Аккаунт активирован: {instance.user.username}")
 
-        try:
-            EmailService.send_activation_success_email(instance.user)
-            logger.info(f"📧 Письмо об успешной активации отправлено на {instance.user.email}")
+        # Добавляем пользователя в группу authors (повторное добавление игнорируется)
+        _add_user_to_group(instance.user_id, 'authors')
+        logger.info(f"👤 Пользователь {instance.user.username} состоит в группе authors")
+
+        # Письмо ставится в очередь только после успешного коммита
+        user = instance.user
+        transaction.on_commit(lambda: enqueue_activation_success_email(user))
 
-            # Добавляем пользователя в группу authors при необходимости
-            if not instance.user.groups.filter(name='authors').exists():
-                authors_group, created = Group.objects.get_or_create(name='authors')
-                instance.user.groups.add(authors_group)
-                logger.info(f"👤 Пользователь {instance.user.username} добавлен в группу authors")
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка при обработке активации: {e}")
+def enqueue_activation_success_email(user):
+    """
+    Ставит письмо об успешной активации в очередь (сбой брокера не влияет на активацию)
+    """
+    try:
+        send_activation_success_email_task.delay(user.pk)
+        logger.info(f"📧 Письмо об успешной активации поставлено в очередь для {user.email}")
+    except (BrokerError, ConnectionError) as e:
+        logger.error(f"❌ Ошибка при постановке письма об активации в очередь: {e}")
 
 
 # 🔄 СИГНАЛЫ ДЛЯ ПОДПИСОК
@@ -198,11 +264,13 @@ def handle_new_subscription(sender, instance, created, **kwargs):
     Обрабатывает новые подписки
     """
     if created:
-        logger.info(f"📩 Новая подписка: {instance.user.username} -> {instance.category.name}")
-        print(f"🎯 сигнал: новая подписка создана - {instance.user.username} -> {instance.category.name}")
-        # Инвалидация кэша подписок
-        cache.delete(f"user_{instance.user.id}_subscriptions")
-        cache.delete(f"category_{instance.category.id}_subscribers_count")
+        logger.info(f"📩 Новая подписка: пользователь {instance.user_id} -> категория {instance.category_id}")
+
+        # Инвалидация кэша подписок (user_id/category_id не требуют загрузки связанных объектов)
+        _delete_cache_on_commit([
+            f"user_{instance.user_id}_subscriptions",
+            f"category_{instance.category_id}_subscribers_count",
+        ])
 
 
 @receiver(post_delete, sender=Subscription)
@@ -210,11 +278,13 @@ def handle_subscription_removed(sender, instance, **kwargs):
     """
     Обрабатывает удаление подписок
     """
-    logger.info(f"📪 Удалена подписка: {instance.user.username} -> {instance.category.name}")
+    logger.info(f"📪 Удалена подписка: пользователь {instance.user_id} -> категория {instance.category_id}")
 
     # Инвалидация кэша подписок
-    cache.delete(f"user_{instance.user.id}_subscriptions")
-    cache.delete(f"category_{instance.category.id}_subscribers_count")
+    _delete_cache_on_commit([
+        f"user_{instance.user_id}_subscriptions",
+        f"category_{instance.category_id}_subscribers_count",
+    ])
 
 
 # 🔄 СИГНАЛЫ ДЛЯ ОЧИСТКИ
@@ -224,11 +294,13 @@ def handle_new_comment(sender, instance, created, **kwargs):
     Обрабатывает новые комментарии
     """
     if created:
-        logger.info(f"💬 Новый комментарий от {instance.user.username} к посту '{instance.post.title}'")
+        logger.info(f"💬 Новый комментарий от пользователя {instance.user_id} к посту {instance.post_id}")
 
         # Инвалидация кэша комментариев
-        cache.delete(f"post_{instance.post.id}_comments")
-        cache.delete(f"post_{instance.post.id}_comments_count")
+        _delete_cache_on_commit([
+            f"post_{instance.post_id}_comments",
+            f"post_{instance.post_id}_comments_count",
+        ])
 
 
 def cleanup_expired_tokens():
@@ -241,20 +313,47 @@ def cleanup_expired_tokens():
             created_at__lt=timezone.now() - timezone.timedelta(days=7)
         )
 
-        count = expired_tokens.count()
+        # На ActivationToken никто не ссылается и нет обработчиков удаления,
+        # поэтому достаточно одного DELETE ... WHERE без загрузки строк и каскада
+        count = expired_tokens._raw_delete(expired_tokens.db)
         if count > 0:
-            expired_tokens.delete()
             logger.info(f"🧹 Очищено {count} просроченных токенов активации")
 
     except Exception as e:
         logger.error(f"❌ Ошибка при очистке токенов: {e}")
 
 
-# 🆕 СИГНАЛ ДЛЯ ЕЖЕНЕДЕЛЬНЫХ РАССЫЛОК
-@receiver(post_save, sender=Post)
-def handle_new_article_for_weekly_digest(sender, instance, created, **kwargs):
+# 🔄 ОТКЛЮЧЕНИЕ СИГНАЛОВ ДЛЯ МАССОВЫХ ОПЕРАЦИЙ
+_SUSPENDABLE_RECEIVERS = (
+    (post_save, handle_user_post_save, User),
+    (post_delete, cleanup_user_group, Author),
+    (m2m_changed, handle_post_categories_changed, Post.categories.through),
+    (post_save, handle_post_save, Post),
+    (post_save, handle_activation_token_save, ActivationToken),
+    (post_save, handle_new_subscription, Subscription),
+    (post_delete, handle_subscription_removed, Subscription),
+    (post_save, handle_new_comment, Comment),
+)
+
+
+@contextmanager
+def suspend_signals():
     """
-    Обрабатывает создание новых статей для еженедельной рассылки
+    Временно отключает обработчики моделей (например, для импорта данных через .save() в цикле):
+
+        with suspend_signals():
+            for row in rows:
+                Post(...).save()
     """
-    if created and instance.post_type == Post.ARTICLE:
-        logger.info(f"📄 Новая статья создана: '{instance.title}' - будет включена в еженедельный дайджест")
\ No newline at end of file
+    # Запоминаем только реально отключенные обработчики: во вложенном блоке они уже отключены
+    # внешним, и восстанавливать их при выходе из вложенного блока нельзя
+    disconnected = [
+        (signal, handler, sender)
+        for signal, handler, sender in _SUSPENDABLE_RECEIVERS
+        if signal.disconnect(handler, sender=sender)
+    ]
+    try:
+        yield
+    finally:
+        for signal, handler, sender in disconnected:
+            signal.connect(handler, sender=sender)
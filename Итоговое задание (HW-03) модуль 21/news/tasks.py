@@ -0,0 +1,74 @@
+from celery import shared_task
+from django.contrib.auth.models import User
+from django.db.models import Prefetch
+import logging
+
+from .models import Post, Category
+from .services.email_service import EmailService
+
+# Настройка логгера
+logger = logging.getLogger('news.tasks')
+
+
+@shared_task
+def send_welcome_email_task(user_id, activation_url):
+    """
+    Фоновая отправка приветственного письма с активацией
+    """
+    try:
+        user = User.objects.get(pk=user_id)
+    except User.DoesNotExist:
+        logger.error(f"❌ Пользователь с ID {user_id} не найден, приветственное письмо не отправлено")
+        return
+
+    EmailService.send_welcome_email(user, activation_url)
+    logger.info(f"📧 Приветственное письмо отправлено на {user.email}")
+
+
+@shared_task
+def send_activation_success_email_task(user_id):
+    """
+    Фоновая отправка письма об успешной активации
+    """
+    try:
+        user = User.objects.get(pk=user_id)
+    except User.DoesNotExist:
+        logger.error(f"❌ Пользователь с ID {user_id} не найден, письмо об активации не отправлено")
+        return
+
+    EmailService.send_activation_success_email(user)
+    logger.info(f"📧 Письмо об успешной активации отправлено на {user.email}")
+
+
+@shared_task
+def send_article_notification_task(post_id):
+    """
+    Фоновая отправка уведомлений подписчикам о новом посте
+    """
+    try:
+        # Подписчики всех категорий загружаются одним запросом вместо запроса на каждую категорию
+        post = Post.objects.select_related('author__user').prefetch_related(
+            Prefetch(
+                'categories',
+                queryset=Category.objects.prefetch_related(
+                    Prefetch('subscribers', to_attr='prefetched_subs')
+                ),
+            )
+        ).only(
+            # Только поля, нужные для писем и флага отправки, вместо всех колонок Post/Author/User
+            'id', 'title', 'content', 'post_type', 'created_at', 'notifications_sent',
+            'author__user__username', 'author__user__email',
+        ).get(pk=post_id)
+    except Post.DoesNotExist:
+        logger.error(f"❌ Пост с ID {post_id} не найден в базе данных")
+        return
+
+    # Отправляем уведомления в зависимости от типа поста
+    if post.post_type == Post.NEWS:
+        # Для новостей используем стандартный метод
+        post.send_notifications_to_subscribers()
+        logger.info("✅ Уведомления о новости успешно отправлены!")
+    elif post.post_type == Post.ARTICLE:
+        # Для статей используем специальный метод из EmailService
+        EmailService.send_immediate_article_notification(post)
+        logger.info("✅ Уведомления о статье успешно отправлены!")
@@ -1,3 +1,85 @@
+from django.contrib.auth.models import Group, User
 from django.test import TestCase
 
-# Create your tests here.
+from news.models import ActivationToken, Author
+from news.signals import _GROUP_IDS, handle_user_signed_up, suspend_signals
+
+
+class GroupIdsCacheTests(TestCase):
+    """Кэш PK групп не должен ссылаться на удаленные группы"""
+
+    def setUp(self):
+        _GROUP_IDS.clear()
+
+    def create_user(self, username):
+        # Выполняем on_commit, чтобы PK группы попал в кэш, как после реального коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            return User.objects.create_user(username, f'{username}@example.com', 'password')
+
+    def test_user_created_after_common_group_deleted(self):
+        self.create_user('first')
+        self.assertIn('common', _GROUP_IDS)
+
+        Group.objects.filter(name='common').delete()
+        user = self.create_user('second')
+
+        self.assertTrue(user.groups.filter(name='common').exists())
+
+    def test_group_id_not_cached_inside_uncommitted_transaction(self):
+        User.objects.create_user('first', 'first@example.com', 'password')
+
+        self.assertNotIn('common', _GROUP_IDS)
+
+    def test_activation_after_author_deleted(self):
+        first = self.create_user('first')
+        # on_commit не выполняем (там постановка письма в очередь), поэтому
+        # кладем PK группы authors в кэш так же, как это сделал бы коммит активации
+        with self.captureOnCommitCallbacks():
+            token = ActivationToken.create_token(first)
+            token.activated = True
+            token.save(update_fields=['activated'])
+        _GROUP_IDS['authors'] = Group.objects.get(name='authors').pk
+
+        # cleanup_user_group удаляет саму группу authors
+        Author.objects.get(user=first).delete()
+        self.assertFalse(Group.objects.filter(name='authors').exists())
+
+        second = self.create_user('second')
+        with self.captureOnCommitCallbacks():
+            token = ActivationToken.create_token(second)
+            token.activated = True
+            token.save(update_fields=['activated'])
+
+        self.assertEqual(
+            sorted(second.groups.values_list('name', flat=True)),
+            ['authors', 'common'],
+        )
+
+    def test_signup_with_stale_group_id_from_another_process(self):
+        user = self.create_user('first')
+        # Группу удалили в другом процессе: локальный кэш о ней не знает
+        stale_group = Group.objects.create(name='stale')
+        stale_id = stale_group.pk
+        stale_group.delete()
+        _GROUP_IDS['common'] = stale_id
+
+        with self.captureOnCommitCallbacks():
+            handle_user_signed_up(sender=None, request=None, user=user)
+
+        self.assertTrue(ActivationToken.objects.filter(user=user).exists())
+        self.assertTrue(user.groups.filter(name='common').exists())
+        self.assertNotEqual(_GROUP_IDS.get('common'), stale_id)
+
+
+class SuspendSignalsTests(TestCase):
+    """Вложенные suspend_signals() не должны включать обработчики раньше времени"""
+
+    def test_nested_blocks_keep_receivers_disconnected(self):
+        with suspend_signals():
+            with suspend_signals():
+                pass
+            user = User.objects.create_user('inner', 'inner@example.com', 'password')
+            self.assertFalse(Author.objects.filter(user=user).exists())
+
+        user = User.objects.create_user('outer', 'outer@example.com', 'password')
+        self.assertTrue(Author.objects.filter(user=user).exists())